@@ -37,6 +37,7 @@ $deployResult = gcloud functions deploy $FUNCTION_NAME `
     --memory=$MEMORY `
     --timeout=$TIMEOUT `
     --trigger=http `
+    --set-build-env-vars="CC=cc -mavx2" `
     --allow-unauthenticated
 
 if ($LASTEXITCODE -eq 0) {
@@ -44,6 +44,7 @@ gcloud functions deploy $FUNCTION_NAME \
     --memory=$MEMORY \
     --timeout=$TIMEOUT \
     --trigger=http \
+    --set-build-env-vars="CC=cc -mavx2" \
     --allow-unauthenticated
 
 if [ $? -eq 0 ]; then
@@ -5,34 +5,130 @@ Serverless API that creates professional property marketing posts
 
 import functions_framework
 from flask import Request, jsonify, send_file
-from PIL import Image, ImageFilter, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageDraw, ImageFont
 import numpy as np
-import piexif
 import os
 import random
 import io
-import base64
-from typing import Optional, List
-import tempfile
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
 from template_generator import BuyersMatchTemplate
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def remove_metadata(image_bytes):
-    """Removes metadata from image bytes."""
-    img = Image.open(io.BytesIO(image_bytes))
+# Shared libjpeg-turbo handle - falls back to PIL if the library is missing
+try:
+    _tj = TurboJPEG()
+except Exception:
+    logger.warning("libturbojpeg not available, falling back to PIL JPEG encoder")
+    _tj = None
+
+# PCG64 generator reused for per-request noise
+_rng = np.random.default_rng()
+
+# Template generator kept warm across invocations
+_GENERATOR = BuyersMatchTemplate()
+
+# Worker threads for decoding interior images (PIL releases the GIL)
+_IMAGE_POOL = ThreadPoolExecutor(max_workers=3)
+
+# Largest accepted size for a single uploaded image
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+
+# Form fields read from each request
+FORM_FIELDS = (
+    'date', 'yield_rate', 'purchase_price', 'current_valuation',
+    'property_title', 'property_type', 'bedrooms', 'bathrooms', 'location',
+    'apply_protection', 'output_format'
+)
+REQUIRED_FIELDS = ('date', 'yield_rate', 'purchase_price', 'current_valuation')
+OUTPUT_FORMATS = ('PNG', 'JPEG')
+
+# Leading bytes of the accepted image formats
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',        # JPEG
+    b'\x89PNG\r\n\x1a\n',  # PNG
+)
+
+def encode_jpeg(img, quality=95):
+    """Encode a PIL image to JPEG bytes using TurboJPEG when available."""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if _tj is not None:
+        return _tj.encode(np.asarray(img), quality=quality,
+                          pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
     output_buffer = io.BytesIO()
-    img.save(output_buffer, format="JPEG", quality=95)
+    img.save(output_buffer, format="JPEG", quality=quality)
     return output_buffer.getvalue()
 
+def parse_form_data(form_data):
+    """Extract and validate all form fields in a single pass.
+    
+    Returns a (data, error message) tuple; the error is None if the form is valid.
+    """
+    data = {field: form_data.get(field) for field in FORM_FIELDS}
+    
+    missing_fields = [field for field in REQUIRED_FIELDS if not data[field]]
+    if missing_fields:
+        return data, f'Missing required fields: {", ".join(missing_fields)}'
+    
+    # Apply defaults and normalise the output options
+    apply_protection = data['apply_protection']
+    data['apply_protection'] = apply_protection is None or apply_protection.lower() == 'true'
+    data['output_format'] = (data['output_format'] or 'PNG').upper()
+    if data['output_format'] not in OUTPUT_FORMATS:
+        return data, f'output_format must be one of: {", ".join(OUTPUT_FORMATS)}'
+    
+    return data, None
+
+def validate_uploaded_image(file_storage):
+    """Check upload size and file signature without decoding it.
+    
+    Returns an (error message, status code) tuple, or None if the upload is valid.
+    """
+    stream = file_storage.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > MAX_UPLOAD_BYTES:
+        return f'file exceeds the {MAX_UPLOAD_BYTES} byte limit', 413
+    
+    header = stream.read(8)
+    stream.seek(0)
+    if not header.startswith(IMAGE_SIGNATURES):
+        return 'file must be a JPEG or PNG image', 400
+    
+    return None
+
+def load_uploaded_image(file_storage, target_size=None):
+    """Decode an uploaded image straight from the request stream.
+    
+    If target_size is given, JPEGs are scaled down during decoding (1/2, 1/4
+    or 1/8 via libjpeg) while staying at least twice that size.
+    """
+    img = Image.open(file_storage.stream)
+    if target_size:
+        img.draft('RGB', (target_size[0] * 2, target_size[1] * 2))
+    # Decode fully while the request's upload stream is still open
+    img.load()
+    return img
+
+def load_interior_image(file_storage):
+    """Decode an interior upload and resize it to its template frame."""
+    img = load_uploaded_image(file_storage, _GENERATOR.interior_size)
+    return _GENERATOR.resize_interior_image(img)
+
+def remove_metadata(img):
+    """Returns a copy of the image with its metadata (EXIF, ICC, comments) dropped."""
+    clean_img = img.copy()
+    clean_img.info = {}
+    return clean_img
+
 def add_watermark(img, text="BuyersMatch", opacity=120, position='center'):
     """Adds semi-transparent watermark text to the image."""
-    watermark = Image.new('RGBA', img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(watermark)
-    
     # Larger font size for visibility
     font_size = int(img.size[1] * 0.08)
     try:
@@ -43,25 +139,32 @@ def add_watermark(img, text="BuyersMatch", opacity=120, position='center'):
         except:
             font = ImageFont.load_default()
     
+    # Measure on a 1x1 canvas - only the text box is ever allocated full size
+    draw = ImageDraw.Draw(Image.new('L', (1, 1)))
     try:
         bbox = draw.textbbox((0, 0), text, font=font)
-        text_size = (bbox[2] - bbox[0], bbox[3] - bbox[1])
     except AttributeError:
-        text_size = draw.textsize(text, font=font)
+        bbox = (0, 0) + draw.textsize(text, font=font)
+    text_size = (bbox[2] - bbox[0], bbox[3] - bbox[1])
     
     if position == 'center':
         text_pos = ((img.size[0] - text_size[0]) // 2, (img.size[1] - text_size[1]) // 2)
     else:  # bottom-right
         text_pos = (img.size[0] - text_size[0] - 20, img.size[1] - text_size[1] - 20)
     
-    draw.text(text_pos, text, font=font, fill=(255, 255, 255, opacity))
+    # Text coverage scaled to the watermark opacity, sized to the text box
+    mask = Image.new('L', (bbox[2], bbox[3]), 0)
+    ImageDraw.Draw(mask).text((0, 0), text, font=font, fill=opacity)
     
-    return Image.alpha_composite(img.convert('RGBA'), watermark).convert('RGB')
+    # Blend white into the text box only
+    watermarked = img.convert('RGB')
+    watermarked.paste((255, 255, 255), text_pos, mask)
+    return watermarked
 
 def slightly_rotate_and_flip(img, max_angle=0.3):
     """Apply very minimal rotation to avoid distortion."""
     angle = random.uniform(-max_angle, max_angle)
-    return img.rotate(angle, expand=False, fillcolor=(255, 255, 255))
+    return img.rotate(angle, resample=Image.BILINEAR, expand=False, fillcolor=(255, 255, 255))
 
 def compress_and_resize(img, quality=92, max_size=None):
     """Compress with minimal size change."""
@@ -69,27 +172,36 @@ def compress_and_resize(img, quality=92, max_size=None):
         img.thumbnail((max_size, max_size), Image.LANCZOS)
     return img
 
+def rgb_image_from_array(arr):
+    """Wrap a uint8 HxWx3 array as an RGB image without going through fromarray."""
+    arr = np.ascontiguousarray(arr, dtype=np.uint8)
+    height, width = arr.shape[:2]
+    return Image.frombuffer('RGB', (width, height), arr, 'raw', 'RGB', 0, 1)
+
 def add_noise(img, amount=0.005):
-    """Add minimal noise to image."""
-    np_img = np.array(img)
-    noise = np.random.randint(-int(255 * amount), int(255 * amount), np_img.shape, dtype=np.int16)
-    np_img = np.clip(np_img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
-    return Image.fromarray(np_img)
+    """Add minimal noise to image, returned as a contiguous uint8 array."""
+    arr = np.asarray(img)
+    amp = int(255 * amount)
+    noise = _rng.integers(-amp, amp, size=arr.shape, dtype=np.int16)
+    # Single int16 working buffer, updated in place
+    np_img = arr.astype(np.int16)
+    np.add(np_img, noise, out=np_img)
+    np.clip(np_img, 0, 255, out=np_img)
+    return np_img.astype(np.uint8)
 
-def protect_image_bytes(image_bytes):
-    """Apply minimal transformations without center watermark."""
-    img = Image.open(io.BytesIO(image_bytes))
-    
+def protect_image(img):
+    """Apply minimal transformations without center watermark and encode to JPEG."""
     img = slightly_rotate_and_flip(img)
     img = compress_and_resize(img)
-    img = add_noise(img, amount=0.005)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    noisy = add_noise(img, amount=0.005)
     # Removed center watermark - only keep the one on the circular image
     
-    output_buffer = io.BytesIO()
-    img.save(output_buffer, format="JPEG", quality=92)
-    output_buffer.seek(0)
-    
-    return output_buffer.getvalue()
+    # Encode the noise buffer directly; only the PIL fallback needs an image
+    if _tj is not None:
+        return _tj.encode(noisy, quality=92, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+    return encode_jpeg(rgb_image_from_array(noisy), quality=92)
 
 @functions_framework.http
 def generate_marketing_post(request: Request):
@@ -128,14 +240,10 @@ def generate_marketing_post(request: Request):
         logger.info(f"Received form data: {list(form_data.keys())}")
         logger.info(f"Received files: {list(files.keys())}")
         
-        # Validate required fields
-        required_fields = ['date', 'yield_rate', 'purchase_price', 'current_valuation']
-        missing_fields = [field for field in required_fields if not form_data.get(field)]
-        
-        if missing_fields:
-            return jsonify({
-                'error': f'Missing required fields: {", ".join(missing_fields)}'
-            }), 400, headers
+        # Extract and validate form fields before touching any image
+        data, form_error = parse_form_data(form_data)
+        if form_error:
+            return jsonify({'error': form_error}), 400, headers
         
         # Validate main image
         if 'main_image' not in files:
@@ -145,42 +253,53 @@ def generate_marketing_post(request: Request):
         if not main_image_file.content_type.startswith('image/'):
             return jsonify({'error': 'Main file must be an image'}), 400, headers
         
+        # Collect optional logo and interior uploads
+        optional_keys = ['logo', 'interior1', 'interior2', 'interior3']
+        upload_keys = ['main_image'] + [
+            key for key in optional_keys
+            if key in files and files[key].content_type.startswith('image/')
+        ]
+        
+        # Validate every upload before decoding any of them
+        for key in upload_keys:
+            upload_error = validate_uploaded_image(files[key])
+            if upload_error:
+                message, status = upload_error
+                return jsonify({'error': f'Invalid {key}: {message}'}), status, headers
+        
         # Read main image
-        main_image_bytes = main_image_file.read()
-        main_img = Image.open(io.BytesIO(main_image_bytes))
+        circle_size = _GENERATOR.circle_size
+        main_img = load_uploaded_image(main_image_file, (circle_size, circle_size))
         
         # Read logo if provided
         logo_img = None
-        if 'logo' in files and files['logo'].content_type.startswith('image/'):
-            logo_bytes = files['logo'].read()
-            logo_img = Image.open(io.BytesIO(logo_bytes))
-        
-        # Read interior images if provided
-        interior_images = []
-        for interior_key in ['interior1', 'interior2', 'interior3']:
-            if interior_key in files and files[interior_key].content_type.startswith('image/'):
-                interior_bytes = files[interior_key].read()
-                interior_img = Image.open(io.BytesIO(interior_bytes))
-                interior_images.append(interior_img)
+        if 'logo' in upload_keys:
+            logo_img = load_uploaded_image(files['logo'], _GENERATOR.logo_size)
+        
+        # Read interior images if provided, decoding them in parallel
+        interior_files = [
+            files[interior_key] for interior_key in ['interior1', 'interior2', 'interior3']
+            if interior_key in upload_keys
+        ]
+        interior_images = list(_IMAGE_POOL.map(load_interior_image, interior_files))
         
         # Prepare comprehensive property data
         property_data = {
-            'date': form_data.get('date'),
-            'yield': form_data.get('yield_rate'),
-            'purchase_price': form_data.get('purchase_price'),
-            'current_valuation': form_data.get('current_valuation'),
-            'property_title': form_data.get('property_title'),
-            'property_type': form_data.get('property_type'),
-            'bedrooms': form_data.get('bedrooms'),
-            'bathrooms': form_data.get('bathrooms'),
-            'location': form_data.get('location')
+            'date': data['date'],
+            'yield': data['yield_rate'],
+            'purchase_price': data['purchase_price'],
+            'current_valuation': data['current_valuation'],
+            'property_title': data['property_title'],
+            'property_type': data['property_type'],
+            'bedrooms': data['bedrooms'],
+            'bathrooms': data['bathrooms'],
+            'location': data['location']
         }
         
         logger.info(f"Processing property data: {property_data}")
         
         # Generate template
-        generator = BuyersMatchTemplate()
-        template_image = generator.create_property_template(
+        template_image = _GENERATOR.create_property_template(
             property_data, 
             main_img, 
             interior_images if interior_images else None,
@@ -188,25 +307,21 @@ def generate_marketing_post(request: Request):
         )
         
         # Apply anti-search protection if requested
-        apply_protection = form_data.get('apply_protection', 'true').lower() == 'true'
-        output_format = form_data.get('output_format', 'PNG').upper()
-        
-        if apply_protection:
-            # Convert template to bytes for protection processing
-            temp_buffer = io.BytesIO()
-            template_image.save(temp_buffer, format="JPEG", quality=95)
-            temp_buffer.seek(0)
-            
-            # Apply protection
-            protected_bytes = protect_image_bytes(temp_buffer.getvalue())
-            final_image_bytes = protected_bytes
+        output_format = data['output_format']
+        
+        if data['apply_protection']:
+            # Apply protection directly to the in-memory template
+            final_image_bytes = protect_image(template_image)
             content_type = "image/jpeg"
         else:
             # Save without protection
-            output_buffer = io.BytesIO()
-            template_image.save(output_buffer, format=output_format, quality=95)
-            output_buffer.seek(0)
-            final_image_bytes = output_buffer.getvalue()
+            if output_format == 'JPEG':
+                final_image_bytes = encode_jpeg(template_image, quality=95)
+            else:
+                output_buffer = io.BytesIO()
+                template_image.save(output_buffer, format=output_format, quality=95)
+                output_buffer.seek(0)
+                final_image_bytes = output_buffer.getvalue()
             content_type = f"image/{output_format.lower()}"
         
         logger.info(f"Generated marketing post successfully. Size: {len(final_image_bytes)} bytes")
@@ -216,7 +331,7 @@ def generate_marketing_post(request: Request):
             io.BytesIO(final_image_bytes),
             mimetype=content_type,
             as_attachment=True,
-            download_name=f"buyersmatch_post_{form_data.get('date', 'unknown').replace(' ', '_')}.{output_format.lower()}"
+            download_name=f"buyersmatch_post_{data['date'].replace(' ', '_')}.{output_format.lower()}"
         )
         
     except Exception as e:
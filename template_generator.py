@@ -4,12 +4,46 @@ Creates professional property marketing templates similar to the provided exampl
 Optimized for serverless deployment with embedded fonts and efficient memory usage.
 """
 
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageDraw, ImageFont
 import numpy as np
-import io
-import os
 from typing import Dict, List, Optional, Tuple
-import base64
+
+def _resolve_font_path(font_paths: List[str]) -> Optional[str]:
+    """Return the first font file PIL can load, probed once at cold start"""
+    for font_path in font_paths:
+        try:
+            ImageFont.truetype(font_path, 12)
+            return font_path
+        except:
+            continue
+    return None
+
+# Try common font paths in Google Cloud
+_REGULAR_FONT_PATH = _resolve_font_path([
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "arial.ttf"
+])
+_BOLD_FONT_PATH = _resolve_font_path([
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "arialbd.ttf"
+])
+
+# Font cache shared by every generator instance
+_FONT_CACHE = {}
+
+# Circular alpha masks keyed by diameter, built on first use
+_CIRCLE_MASKS = {}
+
+# Watermark sprites keyed by circle size, as (sprite, offset in circle)
+_WATERMARK_SPRITES = {}
+
+# (size, bold) pairs used by the template, loaded at import
+_TEMPLATE_FONTS = [
+    (16, False), (18, False), (20, False), (24, False),
+    (24, True), (28, True), (32, True), (36, True), (38, True), (65, True)
+]
 
 class BuyersMatchTemplate:
     def __init__(self):
@@ -23,40 +57,25 @@ class BuyersMatchTemplate:
         
         # Standard template size matching examples
         self.template_size = (1080, 1080)     # Square format
+        self.circle_size = 620                # Main circular image diameter
+        self.logo_size = (180, 80)            # Custom logo frame
+        self.interior_size = (160, 120)       # Interior image frames (was 120x90)
+        self.valuation_banner_y = 620         # Moved up from 680
         
-        # Font cache for serverless efficiency
-        self._font_cache = {}
+        # Font cache for serverless efficiency (shared across instances)
+        self._font_cache = _FONT_CACHE
         
     def _get_font(self, size: int, bold: bool = False):
         """Get font with caching for serverless efficiency"""
         cache_key = f"{size}_{bold}"
         
         if cache_key not in self._font_cache:
+            font_path = _BOLD_FONT_PATH if bold else _REGULAR_FONT_PATH
             try:
-                if bold:
-                    # Try common bold font paths in Google Cloud
-                    font_paths = [
-                        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-                        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-                        "arialbd.ttf"
-                    ]
-                else:
-                    font_paths = [
-                        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-                        "arial.ttf"
-                    ]
-                
-                font = None
-                for font_path in font_paths:
-                    try:
-                        font = ImageFont.truetype(font_path, size)
-                        break
-                    except:
-                        continue
-                
-                if font is None:
+                if font_path is None:
                     font = ImageFont.load_default()
+                else:
+                    font = ImageFont.truetype(font_path, size)
                 
                 self._font_cache[cache_key] = font
             except:
@@ -78,17 +97,14 @@ class BuyersMatchTemplate:
             interior_images: List of up to 3 interior images
             logo_image: Optional BuyersMatch logo file (thumbs up + text)
         """
-        # Create base template with flat cream background
-        template = Image.new('RGB', self.template_size, self.cream_bg)
+        # Start from the pre-rendered background (cream, dots, contact bar)
+        template = _BASE_TEMPLATE.copy()
         draw = ImageDraw.Draw(template)
         
-        # Add simple dot patterns like in examples (no 3D effects)
-        self._add_simple_dot_patterns(draw)
-        
         # Add BuyersMatch logo (top left) - use custom logo if provided
         if logo_image:
             # Resize and place custom logo
-            logo_resized = logo_image.resize((180, 80), Image.LANCZOS)
+            logo_resized = logo_image.resize(self.logo_size, Image.BILINEAR)
             if logo_resized.mode != 'RGBA':
                 logo_resized = logo_resized.convert('RGBA')
             
@@ -104,10 +120,10 @@ class BuyersMatchTemplate:
             else:
                 draw.text((30, 120), date_text, font=date_font, fill=self.dark_brown)
         else:
-            self._add_exact_brand_header(draw, property_data.get('date', 'DEC 2024'), None)
+            self._add_exact_brand_header(template, draw, property_data.get('date', 'DEC 2024'), None)
         
         # Add main circular property image - larger and clean
-        main_circle = self._create_clean_circular_image(main_image, 620)  # Bigger size
+        main_circle = self._create_clean_circular_image(main_image, self.circle_size)  # Bigger size
         # Position to ensure no overlap with left text
         circle_x = 450  # Position from left to ensure text visibility
         circle_y = 80  # Top positioning
@@ -116,72 +132,112 @@ class BuyersMatchTemplate:
         # Add property details section (left side) - clean styling
         self._add_clean_property_details(draw, property_data)
         
-        # Add current valuation banner - flat brown banner like examples
+        # Add current valuation amount (banner itself is part of the base)
         self._add_clean_valuation_banner(draw, property_data.get('current_valuation', '$295,000'))
         
         # Add interior images (bottom) - simple rectangular frames
         if interior_images:
             self._add_clean_interior_images(template, interior_images)
         
+        # Add subtle watermark on main image
+        self._add_clean_buyersmatch_watermark(template, circle_x, circle_y, self.circle_size)
+        
+        return template
+    
+    def _render_base_template(self) -> Image.Image:
+        """Render the static background shared by every post"""
+        # Flat cream background
+        width, height = self.template_size
+        pixels = np.full((height, width, 3), self.cream_bg, dtype=np.uint8)
+        
+        # Add simple dot patterns like in examples (no 3D effects)
+        self._add_simple_dot_patterns(pixels)
+        
+        template = Image.fromarray(pixels)
+        draw = ImageDraw.Draw(template)
+        
+        # Add current valuation banner - flat brown banner like examples
+        self._draw_valuation_banner(draw)
+        
         # Add contact information (bottom brown bar)
         self._add_clean_contact_info(draw)
         
-        # Add subtle watermark on main image
-        self._add_clean_buyersmatch_watermark(template, circle_x, circle_y, 620)
-        
         return template
     
-    def _add_simple_dot_patterns(self, draw: ImageDraw.Draw):
+    def _add_simple_dot_patterns(self, pixels: np.ndarray):
         """Add simple flat dot patterns like in examples"""
         # Small dots in corners - flat, no gradients
         dot_color = (220, 220, 220)  # Light gray
-        dot_size = 3
-        
-        # Top left area dots
-        for i in range(5):
-            for j in range(3):
-                x = 200 + i * 15
-                y = 80 + j * 15
-                draw.ellipse([x, y, x + dot_size, y + dot_size], fill=dot_color)
-        
-        # Bottom right area dots
-        for i in range(4):
-            for j in range(2):
-                x = 850 + i * 15
-                y = 950 + j * 15
-                draw.ellipse([x, y, x + dot_size, y + dot_size], fill=dot_color)
+        dot_pixels = np.arange(3)  # 3x3 pixel dots
+        
+        # Dot grids as (x, y, columns, rows) with 15px spacing
+        dot_grids = [
+            (200, 80, 5, 3),   # Top left area dots
+            (850, 950, 4, 2),  # Bottom right area dots
+        ]
+        
+        for x, y, columns, rows in dot_grids:
+            # Pixel rows/columns covered by every dot in the grid
+            xs = (x + np.arange(columns)[:, None] * 15 + dot_pixels).ravel()
+            ys = (y + np.arange(rows)[:, None] * 15 + dot_pixels).ravel()
+            pixels[np.ix_(ys, xs)] = dot_color
     
-    def _add_exact_brand_header(self, draw: ImageDraw.Draw, date: str, logo_path: Optional[str]):
+    def _add_exact_brand_header(self, template: Image.Image, draw: ImageDraw.Draw, date: str, logo_path: Optional[str]):
         """Add exact BuyersMatch header matching examples"""
+        # Teal banner and BuyersMatch text, pre-rendered at import
+        sprite, position = _HEADER_SPRITE
+        template.paste(sprite, position)
+        
+        # Add date
+        date_font = self._get_font(32, bold=True)
+        draw.text((30, 130), date, fill=self.brand_brown, font=date_font)
+    
+    def _render_header_sprite(self) -> Tuple[Image.Image, Tuple[int, int]]:
+        """Render the static header over the base background, cropped to the area it covers"""
+        canvas = _BASE_TEMPLATE.copy()
+        draw = ImageDraw.Draw(canvas)
+        
         # Teal banner (flat, no shadows)
         banner_height = 80
-        draw.rectangle([30, 30, 400, 30 + banner_height], fill=self.brand_teal)
+        banner_box = (30, 30, 400, 30 + banner_height)
+        draw.rectangle(banner_box, fill=self.brand_teal)
         
         # BuyersMatch text
         title_font = self._get_font(36, bold=True)
         subtitle_font = self._get_font(20)
+        header_text = [
+            ((40, 50), "BUYERS", title_font),
+            ((180, 50), "MATCH", title_font),
+            ((40, 90), "Buyers Advocacy", subtitle_font),
+        ]
         
-        draw.text((40, 50), "BUYERS", fill=self.white, font=title_font)
-        draw.text((180, 50), "MATCH", fill=self.white, font=title_font)
-        draw.text((40, 90), "Buyers Advocacy", fill=self.white, font=subtitle_font)
-        
-        # Add date
-        date_font = self._get_font(32, bold=True)
-        draw.text((30, 130), date, fill=self.brand_brown, font=date_font)
+        # Grow the crop box to include any text hanging below the banner
+        left, top, right, bottom = banner_box
+        for position, text, font in header_text:
+            draw.text(position, text, fill=self.white, font=font)
+            text_box = draw.textbbox(position, text, font=font)
+            left, top = min(left, text_box[0]), min(top, text_box[1])
+            right, bottom = max(right, text_box[2]), max(bottom, text_box[3])
+        
+        # Rectangle corners are inclusive, so extend the crop by one pixel
+        box = (left, top, right + 1, bottom + 1)
+        return canvas.crop(box), (left, top)
     
     def _create_clean_circular_image(self, image: Image.Image, size: int) -> Image.Image:
         """Create clean circular image without shadows or borders"""
         # Resize image to fit circle
         image = image.resize((size, size), Image.LANCZOS)
         
-        # Create circular mask
-        mask = Image.new('L', (size, size), 0)
-        mask_draw = ImageDraw.Draw(mask)
-        mask_draw.ellipse([0, 0, size, size], fill=255)
+        # Create circular mask once per size and reuse it
+        mask = _CIRCLE_MASKS.get(size)
+        if mask is None:
+            mask = Image.new('L', (size, size), 0)
+            mask_draw = ImageDraw.Draw(mask)
+            mask_draw.ellipse([0, 0, size, size], fill=255)
+            _CIRCLE_MASKS[size] = mask
         
         # Apply mask to create circular image
-        circular_img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-        circular_img.paste(image, (0, 0))
+        circular_img = image.convert('RGBA')
         circular_img.putalpha(mask)
         
         return circular_img
@@ -237,9 +293,9 @@ class BuyersMatchTemplate:
         # Ensure the text is positioned where it won't be clipped
         draw.text((35, price_y + 30), price_value, font=purchase_font, fill=self.dark_brown)
     
-    def _add_clean_valuation_banner(self, draw: ImageDraw.Draw, valuation: str):
-        """Add flat brown valuation banner exactly like examples"""
-        banner_y = 620  # Moved up from 680
+    def _draw_valuation_banner(self, draw: ImageDraw.Draw):
+        """Draw the static part of the flat brown valuation banner"""
+        banner_y = self.valuation_banner_y
         banner_height = 80
         
         # Simple flat banner - no shadows or 3D effects
@@ -253,10 +309,15 @@ class BuyersMatchTemplate:
         draw.polygon(banner_points, fill=self.brand_brown)
         
         label_font = self._get_font(16, bold=False)  # Smaller label font
-        value_font = self._get_font(28, bold=True)  # Even smaller value font to ensure it fits
         
         # White text on brown banner - ensure proper positioning
         draw.text((50, banner_y + 12), "CURRENT VALUATION", font=label_font, fill=self.white)
+    
+    def _add_clean_valuation_banner(self, draw: ImageDraw.Draw, valuation: str):
+        """Add the valuation amount onto the pre-rendered banner"""
+        banner_y = self.valuation_banner_y
+        value_font = self._get_font(28, bold=True)  # Even smaller value font to ensure it fits
+        
         # Make sure the valuation text fits within the banner
         draw.text((55, banner_y + 42), valuation, font=value_font, fill=self.white)
     
@@ -267,7 +328,7 @@ class BuyersMatchTemplate:
         
         # Position for interior images (bottom section)
         start_y = 740  # Moved up from 800
-        image_size = (160, 120)  # Bigger size (was 120x90)
+        image_size = self.interior_size
         
         # Use fixed spacing that looks good - similar to original but with equal margins
         num_images = min(len(interior_images), 3)
@@ -280,8 +341,11 @@ class BuyersMatchTemplate:
         start_x = (self.template_size[0] - total_width) // 2
         
         for i, interior_img in enumerate(interior_images[:3]):  # Max 3 images
-            # Resize and position
-            resized_img = interior_img.resize(image_size, Image.LANCZOS)
+            # Resize (unless already done by the caller) and position
+            if interior_img.size == image_size:
+                resized_img = interior_img
+            else:
+                resized_img = self.resize_interior_image(interior_img)
             
             # Position calculation - start centered, then add image width + spacing for each subsequent image
             if num_images == 1:
@@ -293,6 +357,10 @@ class BuyersMatchTemplate:
             # Paste the image
             template.paste(resized_img, (x_pos, y_pos))
     
+    def resize_interior_image(self, image: Image.Image) -> Image.Image:
+        """Resize an interior image to its frame size"""
+        return image.resize(self.interior_size, Image.BILINEAR)
+    
     def _add_clean_contact_info(self, draw: ImageDraw.Draw):
         """Add contact information bar at bottom"""
         # Simple brown bar at bottom - adjusted for new layout
@@ -307,6 +375,18 @@ class BuyersMatchTemplate:
     
     def _add_clean_buyersmatch_watermark(self, template: Image.Image, circle_x: int, circle_y: int, circle_size: int):
         """Add subtle BUYERSMATCH watermark like in examples"""
+        # The watermark never changes, so render it once per circle size
+        cached = _WATERMARK_SPRITES.get(circle_size)
+        if cached is None:
+            cached = self._render_watermark_sprite(circle_size)
+            _WATERMARK_SPRITES[circle_size] = cached
+        
+        # Composite the watermark onto the template
+        sprite, (offset_x, offset_y) = cached
+        template.paste(sprite, (circle_x + offset_x, circle_y + offset_y), sprite)
+    
+    def _render_watermark_sprite(self, circle_size: int) -> Tuple[Image.Image, Tuple[int, int]]:
+        """Render the watermark cropped to its text and return it with its offset in the circle"""
         # Create watermark overlay for just the circular area
         watermark = Image.new('RGBA', (circle_size, circle_size), (0, 0, 0, 0))
         draw = ImageDraw.Draw(watermark)
@@ -328,8 +408,26 @@ class BuyersMatchTemplate:
         # Very subtle white text - like in examples
         draw.text((text_x, text_y), text, font=watermark_font, fill=(255, 255, 255, 100))
         
-        # Composite the watermark onto the template
-        template.paste(watermark, (circle_x, circle_y), watermark)
+        # Crop to the drawn text so the per-request paste only touches those pixels
+        bbox = watermark.getbbox()
+        return watermark.crop(bbox), (bbox[0], bbox[1])
+
+_warmup_generator = BuyersMatchTemplate()
+
+# Pre-load every font the template draws with
+for _size, _bold in _TEMPLATE_FONTS:
+    _warmup_generator._get_font(_size, bold=_bold)
+
+# Static background rendered once at import and copied per request
+_BASE_TEMPLATE = _warmup_generator._render_base_template()
+
+# Teal header used when no custom logo is supplied
+_HEADER_SPRITE = _warmup_generator._render_header_sprite()
+
+# Watermark for the main circle rendered once at import
+_WATERMARK_SPRITES[_warmup_generator.circle_size] = _warmup_generator._render_watermark_sprite(
+    _warmup_generator.circle_size
+)
 
 def create_sample_template():
     """Create a sample template for testing"""